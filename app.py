@@ -1,22 +1,52 @@
 from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from starlette.background import BackgroundTask
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from pathlib import Path
-import tempfile
+from urllib.parse import quote
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import os
 import shutil
 import logging
 
 from ocr_formatter.ocr import OCRProcessor
 from ocr_formatter.formatter import TextFormatter
 
-app = FastAPI(title="AutoNotes - Smart Lecture Notes")
-
 TEMPLATE_PATH = Path(__file__).parent / "templates" / "index.html"
 
+# OCR and LLM calls run in worker threads so the event loop keeps serving
+# uploads/downloads. The model (and its KV cache) can only serve one
+# generate at a time, and the CUDA graphs recorded by torch.compile are
+# bound to the thread that recorded them, so loading, warmup and every
+# LLM call run on one dedicated thread. OCR gets half the cores.
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm")
+OCR_SEMAPHORE = asyncio.Semaphore(max(1, (os.cpu_count() or 2) // 2))
+
+# Shared across requests so the Tesseract engine and the LLM are initialized only once
+OCR = OCRProcessor()
+FORMATTER = LLM_EXECUTOR.submit(TextFormatter).result()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pay the one-time compilation/cache warmup before serving requests
+    await asyncio.get_running_loop().run_in_executor(LLM_EXECUTOR, FORMATTER.warmup)
+    yield
+    LLM_EXECUTOR.shutdown()
+
+app = FastAPI(title="AutoNotes - Smart Lecture Notes", lifespan=lifespan)
+
 @app.get("/", response_class=HTMLResponse)
 async def index():
     return HTMLResponse(TEMPLATE_PATH.read_text(encoding="utf-8"))
 
+def _content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header, RFC 5987-encoding non-ASCII names like FileResponse does."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
 @app.post("/process")
 async def process(
     file: UploadFile = File(...),
@@ -26,69 +56,53 @@ async def process(
 ):
     """Accept an uploaded image or markdown content, run OCR + formatter if needed, and return the resulting file."""
     try:
-        formatter = TextFormatter()
-        
-        # Create a temporary directory that will last for the entire request
-        tmp_dir = tempfile.mkdtemp()
-        
-        try:
-            if markdown_content:
-                # If markdown content is provided, use it directly
-                formatted = markdown_content
-            else:
-                # Process the image
-                in_path = Path(tmp_dir) / file.filename
-                content = await file.read()
-                in_path.write_bytes(content)
-
-                # Run OCR
-                ocr = OCRProcessor()
-                extracted_text = ocr.process_image(str(in_path))
+        if markdown_content:
+            # If markdown content is provided, use it directly
+            formatted = markdown_content
+        else:
+            # Stream the upload into memory in 1 MiB chunks and run OCR on the buffer
+            content = io.BytesIO()
+            await asyncio.to_thread(shutil.copyfileobj, file.file, content, 1024 * 1024)
+            async with OCR_SEMAPHORE:
+                extracted_text = await asyncio.to_thread(
+                    OCR.process_image_bytes, content.getbuffer(), save_debug=False
+                )
 
-                # Run formatter
-                formatted = formatter.format_with_llm(extracted_text)
-
-            # If preview is requested, return JSON
-            if preview == "true" and (output_format == "md" or output_format == "markdown"):
-                return JSONResponse({"text": formatted})
+            # Run formatter
+            formatted = await asyncio.get_running_loop().run_in_executor(
+                LLM_EXECUTOR, FORMATTER.format_with_llm, extracted_text
+            )
 
-            # Save the output file
-            stem = Path(file.filename).stem if file.filename else "notes"
-            
-            if output_format == "md" or output_format == "markdown":
-                out_path = Path(tmp_dir) / f"{stem}.md"
-                formatter.save_as_markdown(formatted, str(out_path))
-                media_type = "text/markdown"
-            else:
-                out_path = Path(tmp_dir) / f"{stem}.docx"
-                formatter.save_as_docx(formatted, str(out_path))
-                media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        # If preview is requested, return JSON
+        if preview == "true" and (output_format == "md" or output_format == "markdown"):
+            return JSONResponse({"text": formatted})
 
-            # Verify the file exists and has content
-            if not out_path.exists():
-                raise Exception(f"Output file was not created at {out_path}")
-            if out_path.stat().st_size == 0:
-                raise Exception("Output file was created but is empty")
+        # Build the output file in memory
+        stem = Path(file.filename).stem if file.filename else "notes"
+        
+        if output_format == "md" or output_format == "markdown":
+            filename = f"{stem}.md"
+            data = formatted.encode("utf-8")
+            media_type = "text/markdown"
+        else:
+            filename = f"{stem}.docx"
+            buf = io.BytesIO()
+            await asyncio.to_thread(FORMATTER.save_as_docx, formatted, buf)
+            data = buf.getvalue()
+            media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
-            # Return file as attachment and schedule temp-dir cleanup after response is sent
-            bg = BackgroundTask(shutil.rmtree, tmp_dir, True)
-            return FileResponse(
-                str(out_path),
-                media_type=media_type,
-                filename=out_path.name,
-                background=bg
-            )
+        if not data:
+            raise Exception("Output file was created but is empty")
 
-        except Exception as e:
-            logging.error(f"Error processing request: {str(e)}")
-            # Clean up immediately on error path
-            try:
-                shutil.rmtree(tmp_dir)
-            except Exception as clean_e:
-                logging.error(f"Error cleaning up temporary directory after failure: {str(clean_e)}")
-            raise
+        # Return file as attachment
+        return Response(
+            content=data,
+            media_type=media_type,
+            headers={"content-disposition": _content_disposition(filename)}
+        )
                 
     except Exception as e:
+        logging.error(f"Error processing request: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Failed to process document: {str(e)}"}
@@ -1,5 +1,77 @@
+import logging
+import os
+import re
+from typing import IO, Optional, Union
+from xml.sax.saxutils import escape
+
+import torch
 from docx import Document
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from transformers import AutoModelForCausalLM, AutoTokenizer, StaticCache
+
+try:
+    # Optional: INT4 weight-only quantization via torchao
+    from torchao.dtypes import Int4CPULayout
+    from torchao.quantization import Int4WeightOnlyConfig
+    from transformers import TorchAoConfig
+except ImportError:
+    Int4WeightOnlyConfig = None
+
+try:
+    # Optional: ONNX Runtime GenAI backend for CPU-only deployments
+    import onnxruntime_genai as og
+except ImportError:
+    og = None
+
+logger = logging.getLogger(__name__)
+
+# Directory produced by onnxruntime_genai.models.builder; when set, the ONNX
+# model is used instead of the Hugging Face one.
+ONNX_MODEL_DIR = os.environ.get("AUTONOTES_ONNX_MODEL_DIR")
+
+# Token budgets for the OCR text and the reply. The system prompt and chat
+# markup come on top of the input budget; together they size the
+# pre-allocated KV cache.
+MAX_INPUT_TOKENS = 1024
+MAX_NEW_TOKENS = 1024
+
+# Reply budget for the startup warmup: enough to run prefill over the full
+# prompt and a few decode steps, without decoding a whole reply
+WARMUP_NEW_TOKENS = 16
+
+SYSTEM_PROMPT = """You are an assistant that formats text extracted from class lectures into markdown notes. Structure the text sections properly with headers, bullet points, and code blocks where appropriate.
+Restrictions:
+1. If there are missing words fill the gaps, but do not change the grammar nor words unless necessary to fix OCR errors.
+2. If there are invented words, correct them appropriately.
+3. If there are non-sense characters, remove them.
+4. Do not add any additional commentary or notes, just provide the formatted text.
+Here is the text:"""
+
+# Stand-in for the user text when rendering the chat template once at startup
+_USER_PLACEHOLDER = "<<AUTONOTES_USER_TEXT>>"
+
+# <think> / </think> markers produced by the LLM
+_THINK_TAG_RE = re.compile(r"</?think>", re.IGNORECASE)
+
+# Markdown constructs understood by save_as_docx
+_HEADING_RE = re.compile(r"^(#+)\s*(.*)$")
+_BULLET_RE = re.compile(r"^\s*[-*]\s+(.*)$")
+
+# Bullet marks as they come out of OCR, for the rule-based formatter
+_OCR_BULLET_RE = re.compile(r"^(?:[-*]\s+|[•·‣◦▪●]\s*)(.+)$")
+# Numbered list items ("1. INTRO", "2) TODO"), never promoted to headers
+_NUMBERED_RE = re.compile(r"^\d+[.)]\s")
+
+# Short, clean OCR text below these limits is formatted without the LLM
+QUICK_FORMAT_MAX_CHARS = 300
+QUICK_FORMAT_MIN_ALPHA_RATIO = 0.7
+
+# Decoding settings shared by the startup warmup and format_with_llm, so the
+# static cache is allocated with the batch shape real requests use.
+# Greedy decoding: beam search multiplied per-token work and KV cache size by
+# the beam count, and near-zero temperature sampling was greedy anyway.
+GENERATION_KWARGS = {"num_beams": 1, "do_sample": False, "use_cache": True}
 
 class ModelManager:
     _instance = None
@@ -10,99 +82,330 @@ class ModelManager:
             cls._instance = cls._load_model()
         return cls._instance
     
+    @staticmethod
+    def _select_dtype():
+        # BF16 halves weight bandwidth vs FP32 on CPU and Ampere+ GPUs;
+        # older GPUs (and MPS) only have fast FP16 kernels.
+        if torch.cuda.is_available():
+            major, _ = torch.cuda.get_device_capability()
+            return torch.bfloat16 if major >= 8 else torch.float16
+        if torch.backends.mps.is_available():
+            return torch.float16
+        return torch.bfloat16
+
+    @staticmethod
+    def _quantization_config(dtype):
+        # Decoding streams every weight once per token, so INT4 weights cut
+        # that traffic ~4x; activations stay in BF16, which torchao's int4
+        # kernels require.
+        if Int4WeightOnlyConfig is None or dtype != torch.bfloat16:
+            return None
+        if torch.cuda.is_available():
+            return TorchAoConfig(Int4WeightOnlyConfig(group_size=128))
+        return TorchAoConfig(Int4WeightOnlyConfig(group_size=128, layout=Int4CPULayout()))
+
     @staticmethod
     def _load_model():
         # Using Qwen model for efficient text formatting
         model_name = "Qwen/Qwen3-0.6B"
         tokenizer = AutoTokenizer.from_pretrained(model_name)
+        prefix_ids, suffix_ids = ModelManager._prompt_ids(tokenizer)
+
+        if ONNX_MODEL_DIR and og is None:
+            logger.warning(
+                "AUTONOTES_ONNX_MODEL_DIR is set but onnxruntime_genai is not installed; "
+                "falling back to the Hugging Face model"
+            )
+        if og is not None and ONNX_MODEL_DIR:
+            # The exported model shares the HF vocabulary, so the HF tokenizer
+            # is still used to render and encode prompts.
+            return {
+                "backend": "onnx",
+                "model": og.Model(ONNX_MODEL_DIR),
+                "tokenizer": tokenizer,
+                "prefix_ids": prefix_ids,
+                "suffix_ids": suffix_ids
+            }
+
+        dtype = ModelManager._select_dtype()
         model = AutoModelForCausalLM.from_pretrained(
             model_name,
-            torch_dtype="auto",
-            device_map="auto"
+            torch_dtype=dtype,
+            device_map="auto",
+            # Fused scaled-dot-product attention kernels for prefill
+            attn_implementation="sdpa",
+            quantization_config=ModelManager._quantization_config(dtype)
+        )
+        model.eval()
+        # Compile the forward pass (generate() calls it once per token)
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+
+        # Pre-allocated KV cache, reused across requests so the compiled graph
+        # always sees the same buffers. Sized from the measured template
+        # length, so the longest prompt plus reply always fits.
+        max_cache_len = len(prefix_ids) + len(suffix_ids) + MAX_INPUT_TOKENS + MAX_NEW_TOKENS
+        cache = StaticCache(config=model.config, max_cache_len=max_cache_len)
+
+        # KV tensors for the prompt prefix, shared read-only by every request.
+        # Computed here, next to the cache, so creating a TextFormatter never
+        # touches the cache while another request is using it.
+        prefix_kv = ModelManager._compute_prefix_kv(model, cache, prefix_ids)
+
+        return {
+            "backend": "hf",
+            "model": model,
+            "tokenizer": tokenizer,
+            "cache": cache,
+            "prefix_ids": prefix_ids,
+            "suffix_ids": suffix_ids,
+            "prefix_kv": prefix_kv
+        }
+
+    @staticmethod
+    def _prompt_ids(tokenizer) -> tuple:
+        """
+        Render the chat template once and split it around the user text.
+        
+        The prefix holds the system turn and the user-turn header, the suffix
+        closes the user turn and opens the assistant's; requests only
+        tokenize their text.
+        
+        Args:
+            tokenizer: Model tokenizer
+            
+        Returns:
+            tuple: (prefix_ids, suffix_ids) token ID lists
+        """
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": _USER_PLACEHOLDER}
+        ]
+        rendered = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prefix, suffix = rendered.split(_USER_PLACEHOLDER)
+        return (
+            tokenizer(prefix, add_special_tokens=False).input_ids,
+            tokenizer(suffix, add_special_tokens=False).input_ids
         )
-        return {"model": model, "tokenizer": tokenizer}
+
+    @staticmethod
+    def _compute_prefix_kv(model, cache: StaticCache, prefix_ids: list) -> list:
+        """
+        Run the fixed prompt prefix through the model once and keep its KV tensors.
+        
+        Args:
+            model: Causal LM
+            cache: Pre-allocated KV cache, used as scratch space and left reset
+            prefix_ids: Prefix token IDs
+            
+        Returns:
+            list: (keys, values) per layer, each of shape (1, heads, prefix_len, head_dim)
+        """
+        n = len(prefix_ids)
+        with torch.inference_mode():
+            cache.reset()
+            model(torch.tensor([prefix_ids], device=model.device), past_key_values=cache, use_cache=True)
+            prefix_kv = [
+                (layer.keys[:, :, :n].clone(), layer.values[:, :, :n].clone())
+                for layer in cache.layers
+            ]
+            cache.reset()
+        return prefix_kv
+
+    @staticmethod
+    def restore_prefix_kv(cache: StaticCache, prefix_kv: list):
+        """
+        Copy the prefix KV tensors into the start of a freshly reset cache.
+        
+        Must run inside torch.inference_mode().
+        
+        Args:
+            cache: Pre-allocated KV cache
+            prefix_kv: Output of _compute_prefix_kv
+        """
+        for layer, (keys, values) in zip(cache.layers, prefix_kv):
+            n = keys.shape[2]
+            layer.keys[:, :, :n].copy_(keys)
+            layer.values[:, :, :n].copy_(values)
+            # Newer StaticLayers track their length in a counter instead of
+            # counting non-zero key rows; advance it in place, keeping the
+            # tensor's static address for the compiled graph.
+            if isinstance(getattr(layer, "cumulative_length", None), torch.Tensor):
+                layer.cumulative_length.fill_(n)
 
 class TextFormatter:
     def __init__(self):
         """Initialize the text formatter with T5 model."""
         self.model_manager = ModelManager.get_instance()
 
-        
+        # Chat template token IDs and prefix KV, computed once by ModelManager
+        self._prefix_ids = self.model_manager["prefix_ids"]
+        self._suffix_ids = self.model_manager["suffix_ids"]
+
     def format_with_llm(self, text: str) -> str:
         """
         Format text using Qwen model.
         
+        Short, clean text is formatted with simple rules instead, skipping
+        the model entirely.
+        
         Args:
             text: Input text to format
             
         Returns:
             str: Formatted text
         """
-        # Create the system and user messages
-        messages = [
-            {
-                "role": "system",
-                "content": """You are an assistant that formats text extracted from class lectures into markdown notes. Structure the text sections properly with headers, bullet points, and code blocks where appropriate.
-Restrictions:
-1. If there are missing words fill the gaps, but do not change the grammar nor words unless necessary to fix OCR errors.
-2. If there are invented words, correct them appropriately.
-3. If there are non-sense characters, remove them.
-4. Do not add any additional commentary or notes, just provide the formatted text.
-Here is the text:"""
-            },
-            {
-                "role": "user",
-                "content": text
-            }
-        ]
+        if self._is_simple_text(text):
+            return self._quick_format(text)
+        return self._format_with_model(text)
+
+    def warmup(self):
+        """
+        Run one formatting pass so the first real request does not pay for
+        graph compilation and KV cache setup.
+        """
+        self._format_with_model("warmup", max_new_tokens=WARMUP_NEW_TOKENS)
+
+    def _format_with_model(self, text: str, max_new_tokens: int = MAX_NEW_TOKENS) -> str:
+        """
+        Format text by prompting the model.
         
-        # Get model and tokenizer
-        model = self.model_manager["model"]
+        Args:
+            text: Input text to format
+            max_new_tokens: Maximum number of tokens to generate
+            
+        Returns:
+            str: Formatted text
+        """
         tokenizer = self.model_manager["tokenizer"]
         
-        # Convert messages to chat template format
-        input_ids = tokenizer.apply_chat_template(
-            messages,
-            return_tensors="pt",
-            max_length=2048,
+        # Tokenize only the OCR text, truncated so the system prompt is never
+        # cut, and splice it between the cached template token IDs
+        user_ids = tokenizer(
+            text,
+            add_special_tokens=False,
+            max_length=MAX_INPUT_TOKENS,
             truncation=True
-        ).to(model.device)
+        ).input_ids
+        input_ids = torch.tensor([self._prefix_ids + user_ids + self._suffix_ids])
         
         # Generate response
-        outputs = model.generate(
-            input_ids,
-            max_length=2048,
-            num_beams=4,
-            temperature=0.01,
-            do_sample=True,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.pad_token_id
-        )
-        
-        output_ids = outputs[0][len(input_ids[0]):].tolist() 
+        if self.model_manager["backend"] == "onnx":
+            output_ids = self._generate_onnx(input_ids, max_new_tokens)
+        else:
+            output_ids = self._generate_hf(input_ids, max_new_tokens)
         formatted_text = tokenizer.decode(output_ids, skip_special_tokens=True)
         # Remove any <think> artifacts produced by the LLM.
-        # If both opening and closing tags exist, remove the tags and everything between them.
-        # Otherwise remove any lone tag left behind.
-        print(f"Formatted text before cleaning: {formatted_text}")
-        try:
-        # Find the first occurrence of either '<think>' or '</think>'
-            idx = formatted_text.lower().find('</think>')
-            if idx == -1:
-                idx = formatted_text.lower().find('<think>')
-            
-            # If any tag is found, remove everything before and including it
-            if idx != -1:
-                formatted_text = formatted_text[idx + len('</think>'):]
-        except Exception:
-            # Fallback: do nothing, keep text as is
-            pass
-        print(f"Formatted text after cleaning: {formatted_text}")
+        # The reasoning always precedes the answer, so drop everything up to
+        # and including the last <think> or </think> tag.
+        logger.debug("Formatted text before cleaning: %s", formatted_text)
+        formatted_text = _THINK_TAG_RE.split(formatted_text)[-1]
+        logger.debug("Formatted text after cleaning: %s", formatted_text)
         # Trim leftover whitespace/newlines caused by removals
         formatted_text = formatted_text.strip()
 
         return formatted_text
 
+    @staticmethod
+    def _is_simple_text(text: str) -> bool:
+        """
+        Check whether text is short and clean enough to skip the model.
+        
+        Args:
+            text: OCR text
+            
+        Returns:
+            bool: True for short, printable, mostly alphabetic text
+        """
+        return (
+            0 < len(text) < QUICK_FORMAT_MAX_CHARS
+            and text.replace('\n', '').isprintable()
+            and sum(c.isalpha() for c in text) / len(text) > QUICK_FORMAT_MIN_ALPHA_RATIO
+        )
+
+    @staticmethod
+    def _quick_format(text: str) -> str:
+        """
+        Format short text as markdown with simple rules: all-caps lines of at
+        least two letters become headers and lines with a leading bullet mark
+        become list items.
+        
+        Args:
+            text: Input text to format
+            
+        Returns:
+            str: Formatted text
+        """
+        lines = []
+        for line in text.split('\n'):
+            line = line.strip()
+            # Bullets first, so an all-caps list item stays a list item
+            m = _OCR_BULLET_RE.match(line)
+            if m:
+                line = f"- {m.group(1)}"
+            elif (
+                line.isupper()
+                # Not a lone initial or roman numeral like "I" or "A."
+                and sum(c.isalpha() for c in line) >= 2
+                and not _HEADING_RE.match(line)
+                and not _NUMBERED_RE.match(line)
+            ):
+                line = f"# {line}"
+            lines.append(line)
+        return '\n'.join(lines).strip()
+
+    def _generate_hf(self, input_ids: torch.Tensor, max_new_tokens: int = MAX_NEW_TOKENS) -> list:
+        """
+        Generate reply token IDs with the Hugging Face model.
+        
+        Args:
+            input_ids: Prompt token IDs, shape (1, seq_len)
+            max_new_tokens: Maximum number of tokens to generate
+            
+        Returns:
+            list: Generated token IDs, without the prompt
+        """
+        model = self.model_manager["model"]
+        tokenizer = self.model_manager["tokenizer"]
+        cache = self.model_manager["cache"]
+        input_ids = input_ids.to(model.device)
+
+        # Reuse the pre-allocated KV cache, seeded with the prefix's KV so
+        # prefill only runs over the OCR text and the closing template tokens
+        with torch.inference_mode():
+            cache.reset()
+            ModelManager.restore_prefix_kv(cache, self.model_manager["prefix_kv"])
+            outputs = model.generate(
+                input_ids,
+                max_new_tokens=max_new_tokens,
+                past_key_values=cache,
+                **GENERATION_KWARGS,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        return outputs[0][len(input_ids[0]):].tolist()
+
+    def _generate_onnx(self, input_ids: torch.Tensor, max_new_tokens: int = MAX_NEW_TOKENS) -> list:
+        """
+        Generate reply token IDs with the ONNX Runtime GenAI model.
+        
+        Args:
+            input_ids: Prompt token IDs, shape (1, seq_len)
+            max_new_tokens: Maximum number of tokens to generate
+            
+        Returns:
+            list: Generated token IDs, without the prompt
+        """
+        model = self.model_manager["model"]
+        prompt_ids = input_ids[0].tolist()
+
+        params = og.GeneratorParams(model)
+        params.set_search_options(max_length=len(prompt_ids) + max_new_tokens, do_sample=False)
+        generator = og.Generator(model, params)
+        generator.append_tokens(prompt_ids)
+        while not generator.is_done():
+            generator.generate_next_token()
+        return generator.get_sequence(0)[len(prompt_ids):].tolist()
+
     def save_as_markdown(self, text: str, output_path: str):
         """
         Save formatted text as a Markdown file.
@@ -114,65 +417,117 @@ Here is the text:"""
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(text)
     
-    def save_as_docx(self, text: str, output_path: str):
+    def save_as_docx(self, text: str, output_path: Union[str, IO[bytes]]):
         """
         Save formatted text as a DOCX file, preserving basic markdown formatting.
         
         Args:
             text: Formatted text (in markdown format)
-            output_path: Path to save the DOCX file
+            output_path: Path to save the DOCX file, or a binary file-like object
         """
         # Create a new Document
         doc = Document()
         
-        # Split text into paragraphs
-        paragraphs = text.split('\n')
-        
-        for line in paragraphs:
+        # Build the WordprocessingML for every paragraph as one string;
+        # inserting paragraphs one by one through python-docx rescans the
+        # body on each insert, which is quadratic on long notes.
+        paragraphs = []
+        for line in text.split('\n'):
             line = line.rstrip()
             
             # Skip empty lines
             if not line:
-                doc.add_paragraph()
+                paragraphs.append('<w:p/>')
                 continue
             
             # Handle headers
-            if line.startswith('#'):
-                level = len(line) - len(line.lstrip('#'))
-                title = line.lstrip('#').strip()
-                doc.add_heading(title, level=min(level, 9))
+            m = _HEADING_RE.match(line)
+            if m:
+                style = f"Heading{min(len(m.group(1)), 9)}"
+                paragraphs.append(self._paragraph_xml(self._run_xml(m.group(2).strip()), style))
                 continue
             
-            # Handle list items
-            if line.strip().startswith(('- ', '* ')):
-                p = doc.add_paragraph(style='List Bullet')
-                text = line.lstrip('- *').strip()
-                # Handle bold text in list items
-                if '**' in text:
-                    parts = text.split('**')
-                    for i, part in enumerate(parts):
-                        run = p.add_run(part)
-                        if i % 2 == 1:  # Odd indices are bold
-                            run.bold = True
-                else:
-                    p.add_run(text)
-                continue
-            
-            # Handle regular paragraphs with potential bold text
-            p = doc.add_paragraph()
-            if '**' in line:
-                parts = line.split('**')
-                for i, part in enumerate(parts):
-                    run = p.add_run(part)
-                    if i % 2 == 1:  # Odd indices are bold
-                        run.bold = True
+            # Handle list items, then regular paragraphs, with potential bold text
+            m = _BULLET_RE.match(line)
+            if m:
+                paragraphs.append(self._paragraph_xml(self._runs_xml(m.group(1)), 'ListBullet'))
             else:
-                p.add_run(line)
+                paragraphs.append(self._paragraph_xml(self._runs_xml(line)))
+        
+        # Parse once and insert everything ahead of the section properties
+        # (body.sectPr scans the body's children, so look it up only once)
+        body = doc.element.body
+        sect_pr = body.sectPr
+        parsed = parse_xml(f'<w:body {nsdecls("w")}>{"".join(paragraphs)}</w:body>')
+        for p in list(parsed):
+            if sect_pr is not None:
+                sect_pr.addprevious(p)
+            else:
+                body.append(p)
         
         # Save the document with error handling
         try:
             doc.save(output_path)
         except Exception as e:
-            import logging
-            logging.error(f"Error saving DOCX file: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error(f"Error saving DOCX file: {str(e)}")
+            raise
+
+    @staticmethod
+    def _paragraph_xml(runs: str, style: Optional[str] = None) -> str:
+        """
+        Build a <w:p> element.
+        
+        Args:
+            runs: Run XML for the paragraph content
+            style: Optional paragraph style ID (e.g. 'Heading1', 'ListBullet')
+            
+        Returns:
+            str: Paragraph XML
+        """
+        if style:
+            return f'<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr>{runs}</w:p>'
+        return f'<w:p>{runs}</w:p>'
+
+    @staticmethod
+    def _run_xml(text: str, bold: bool = False) -> str:
+        """
+        Build a <w:r> element for plain text.
+        
+        Args:
+            text: Run text
+            bold: Whether the run is bold
+            
+        Returns:
+            str: Run XML
+        """
+        props = '<w:rPr><w:b/></w:rPr>' if bold else ''
+        # Tabs must be <w:tab/> elements, as python-docx's add_run emits them
+        content = '<w:tab/>'.join(f'<w:t xml:space="preserve">{escape(chunk)}</w:t>' for chunk in text.split('\t'))
+        return f'<w:r>{props}{content}</w:r>'
+
+    def _runs_xml(self, text: str) -> str:
+        """
+        Build the runs for a line of markdown, rendering **bold** spans as bold runs.
+        
+        Args:
+            text: Line of markdown text
+            
+        Returns:
+            str: Run XML
+        """
+        # Walk the line once with str.find, emitting a run per span
+        runs = []
+        i = 0
+        while i < len(text):
+            start = text.find('**', i)
+            end = text.find('**', start + 2) if start >= 0 else -1
+            if end < 0:
+                # No complete bold span left, the rest is plain text
+                runs.append(self._run_xml(text[i:]))
+                break
+            if start > i:
+                runs.append(self._run_xml(text[i:start]))
+            if end > start + 2:
+                runs.append(self._run_xml(text[start + 2:end], bold=True))
+            i = end + 2
+        return ''.join(runs)
@@ -0,0 +1,26 @@
+import importlib
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("cv2")
+pytest.importorskip("pytesseract")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("docx")
+
+
+@pytest.fixture(scope="module")
+def app():
+    # Importing app builds the shared OCR processor and formatter; keep them
+    # from loading Tesseract and the model
+    with mock.patch("ocr_formatter.ocr.OCRProcessor"), mock.patch("ocr_formatter.formatter.TextFormatter"):
+        module = importlib.import_module("app")
+    yield module
+    module.LLM_EXECUTOR.shutdown()
+
+
+def test_content_disposition(app):
+    assert app._content_disposition("notes.md") == 'attachment; filename="notes.md"'
+    assert app._content_disposition("apuntes ñ.md") == "attachment; filename*=utf-8''apuntes%20%C3%B1.md"
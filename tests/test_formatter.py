@@ -0,0 +1,115 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("docx")
+
+from ocr_formatter.formatter import TextFormatter
+
+
+@pytest.fixture
+def formatter():
+    # Skip __init__, which loads the model; the helpers under test don't need it
+    return TextFormatter.__new__(TextFormatter)
+
+
+def test_quick_format_headers_and_bullets():
+    text = "LECTURE ONE\n• first point\n- SECOND POINT\nplain line"
+    assert TextFormatter._quick_format(text) == (
+        "# LECTURE ONE\n- first point\n- SECOND POINT\nplain line"
+    )
+
+
+def test_quick_format_all_caps_bullets_stay_list_items():
+    assert TextFormatter._quick_format("- NOTE") == "- NOTE"
+    assert TextFormatter._quick_format("• TODO") == "- TODO"
+
+
+def test_quick_format_short_or_numbered_caps_are_not_headers():
+    assert TextFormatter._quick_format("I") == "I"
+    assert TextFormatter._quick_format("A.") == "A."
+    assert TextFormatter._quick_format("1. INTRO") == "1. INTRO"
+
+
+def test_quick_format_keeps_existing_headers():
+    assert TextFormatter._quick_format("# INTRO") == "# INTRO"
+
+
+def test_is_simple_text():
+    assert TextFormatter._is_simple_text("Short notes about\nphotosynthesis")
+    assert not TextFormatter._is_simple_text("")
+    assert not TextFormatter._is_simple_text("word " * 100)
+    assert not TextFormatter._is_simple_text("x = 1; y = 2; z = 3;")
+    assert not TextFormatter._is_simple_text("tab\there")
+
+
+def test_runs_xml_bold_spans(formatter):
+    xml = formatter._runs_xml("a **b** c")
+    assert xml == (
+        '<w:r><w:t xml:space="preserve">a </w:t></w:r>'
+        '<w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">b</w:t></w:r>'
+        '<w:r><w:t xml:space="preserve"> c</w:t></w:r>'
+    )
+
+
+def test_runs_xml_unmatched_marker_is_literal(formatter):
+    assert formatter._runs_xml("a ** b") == '<w:r><w:t xml:space="preserve">a ** b</w:t></w:r>'
+
+
+def test_runs_xml_escapes_text(formatter):
+    assert "&lt;x&gt; &amp;" in formatter._runs_xml("<x> &")
+
+
+def test_save_as_docx_styles(formatter, tmp_path):
+    from docx import Document
+
+    out = tmp_path / "notes.docx"
+    formatter.save_as_docx("# Title\n\n- item **bold**\nplain", str(out))
+
+    paragraphs = Document(str(out)).paragraphs
+    assert [p.style.name for p in paragraphs] == ["Heading 1", "Normal", "List Bullet", "Normal"]
+    assert [(r.text, r.bold) for r in paragraphs[2].runs] == [("item ", None), ("bold", True)]
+
+
+def test_restored_prefix_kv_matches_full_prompt_generate():
+    # generate() infers the cached length from StaticLayer.get_seq_length
+    # (non-zero key rows, or a length counter on newer releases), so seeding the cache with the prefix KV must give
+    # the same greedy reply as prefilling the whole prompt.
+    from transformers import AutoModelForCausalLM, Qwen3Config, StaticCache
+
+    from ocr_formatter.formatter import GENERATION_KWARGS, ModelManager
+
+    torch = pytest.importorskip("torch")
+    torch.manual_seed(0)
+    config = Qwen3Config(
+        vocab_size=128,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        max_position_embeddings=128
+    )
+    model = AutoModelForCausalLM.from_config(config).eval()
+    prefix_ids = [5, 17, 42, 9, 100, 3]
+    input_ids = torch.tensor([prefix_ids + [64, 23, 77, 11]])
+
+    with torch.inference_mode():
+        expected = model.generate(input_ids, max_new_tokens=8, **GENERATION_KWARGS, pad_token_id=0)
+
+    cache = StaticCache(config=config, max_cache_len=64)
+    prefix_kv = ModelManager._compute_prefix_kv(model, cache, prefix_ids)
+    with torch.inference_mode():
+        cache.reset()
+        ModelManager.restore_prefix_kv(cache, prefix_kv)
+        assert int(cache.get_seq_length()) == len(prefix_ids)
+        actual = model.generate(
+            input_ids,
+            max_new_tokens=8,
+            past_key_values=cache,
+            **GENERATION_KWARGS,
+            pad_token_id=0
+        )
+
+    assert actual.tolist() == expected.tolist()
@@ -0,0 +1,80 @@
+import time
+from unittest import mock
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("pytesseract")
+
+import numpy as np
+
+from ocr_formatter.ocr import OCRProcessor
+
+
+def _reference_preprocess(img):
+    # Preprocessing as it was before the in-place (dst=) rewrite
+    img = cv2.medianBlur(img, 3)
+    background = cv2.medianBlur(img, 25)
+    normalized = cv2.divide(img, background, scale=255)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    enhanced = clahe.apply(normalized)
+    _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    binary = cv2.dilate(binary, np.ones((1, 1), np.uint8), iterations=1)
+    blur = cv2.GaussianBlur(binary, (3, 3), 0)
+    sharpened = cv2.addWeighted(binary, 1.5, blur, -0.5, 0)
+    if np.mean(sharpened) < 127:
+        sharpened = cv2.bitwise_not(sharpened)
+    return cv2.resize(sharpened, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+
+def _synthetic_page():
+    # Unevenly lit page with some text and sensor noise
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(150, 240, 320, dtype=np.float32)
+    img = np.tile(gradient, (200, 1))
+    img += rng.normal(0, 8, img.shape)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    cv2.putText(img, "Lecture 1", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 30, 3)
+    cv2.putText(img, "- first point", (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 40, 2)
+    return img
+
+
+def _black_page():
+    # Background normalization maps a black page to zeros, so the
+    # preprocessed image comes out dark and gets inverted
+    img = np.zeros((200, 320), np.uint8)
+    cv2.putText(img, "Lecture 1", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 255, 3)
+    return img
+
+
+@pytest.fixture
+def processor():
+    return OCRProcessor()
+
+
+@pytest.mark.parametrize("make_page", [_synthetic_page, _black_page])
+def test_extract_text_matches_reference_preprocessing(processor, make_page):
+    img = make_page()
+    expected = _reference_preprocess(img.copy())
+
+    with mock.patch.object(OCRProcessor, "_recognize", return_value=" text \n") as recognize:
+        assert processor._extract_text(img, save_debug=False) == "text"
+
+    np.testing.assert_array_equal(np.asarray(recognize.call_args.args[0]), expected)
+
+
+def test_process_multiple_images_keeps_input_order(processor):
+    paths = [f"page{i}.png" for i in range(6)]
+
+    def process_image(path):
+        # Earlier pages finish last
+        time.sleep(0.01 * (len(paths) - paths.index(path)))
+        return path
+
+    with mock.patch.object(processor, "process_image", side_effect=process_image):
+        assert processor.process_multiple_images(paths, max_workers=3) == paths
+
+
+def test_process_image_bytes_rejects_undecodable_data(processor):
+    with pytest.raises(ValueError, match="Could not decode image data"):
+        processor.process_image_bytes(b"not an image")